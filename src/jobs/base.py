@@ -1,6 +1,7 @@
+import functools
 from abc import ABC, abstractmethod
 from enum import Enum, auto
-from typing import Set
+from typing import FrozenSet
 
 from services.service_provider_abc import ServiceProviderABC
 
@@ -14,8 +15,9 @@ class JobType(Enum):
     UMI_DEDUP = auto()
 
     @classmethod
-    def get_type_names(cls) -> Set[str]:
-        return {job_type.get_job_name() for job_type in cls}
+    @functools.lru_cache(maxsize=None)
+    def get_type_names(cls) -> FrozenSet[str]:
+        return frozenset(job_type.get_job_name() for job_type in cls)
 
     def get_job_name(self) -> str:
         return self.name.lower()
@@ -1,15 +1,15 @@
+import concurrent.futures
 import logging
 import re
-import shutil
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 from jobs.base import JobType, JobABC
 from jobs.util import FastqPairMatcher, GCPFastqPair, LocalFastqPair
 from services.gcp.base import GCPPath
 from services.service_provider_abc import ServiceProviderABC
-from util import create_or_cleanup_dir
+from util import temporary_dir
 
 
 @dataclass(frozen=True)
@@ -17,8 +17,14 @@ class DnaAlignJob(JobABC):
     input_path: GCPPath
     ref_genome_path: GCPPath
     output_path: GCPPath
+    # Every alignment loads the full reference genome index into memory, so lanes are aligned one at a time by default
+    max_parallel_lane_count: int = 1
 
-    RECORD_GROUP_ID_REGEX = re.compile(r"([^_]+_){1,2}S[0-9]+_L[0-9]{3}_R[1-2].*")
+    RECORD_GROUP_ID_REGEX = re.compile(r"([^_]+_){1,2}S[0-9]+_L[0-9]{3}_R[1-2]")
+    # Number of FASTQ pairs that can be downloading while a lane is being aligned
+    FASTQ_PAIR_PREFETCH_COUNT = 2
+    # Lane bams that still need to be merged are only read back once, so favour speed over size
+    INTERMEDIATE_LANE_BAM_COMPRESSION_LEVEL = 1
 
     @classmethod
     def get_job_type(cls) -> JobType:
@@ -30,6 +36,7 @@ class DnaAlignJob(JobABC):
         logging.info(f"    input_path  = {self.input_path}")
         logging.info(f"    ref_genome  = {self.ref_genome_path}")
         logging.info(f"    output_path = {self.output_path}")
+        logging.info(f"    max_parallel_lane_count = {self.max_parallel_lane_count}")
 
         gcp_client = service_provider.get_gcp_client()
         gcp_file_cache = service_provider.get_gcp_file_cache()
@@ -38,7 +45,16 @@ class DnaAlignJob(JobABC):
             logging.info("Skipping job. Output file already exists in bucket")
             return
 
-        fastq_gcp_paths = gcp_client.get_matching_file_paths(self.input_path)
+        # Both listings are independent, so do them at the same time
+        reference_genome_dir = self.ref_genome_path.get_parent_directory()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            fastq_gcp_paths_future = executor.submit(gcp_client.get_matching_file_paths, self.input_path)
+            logging.info(f"Searching for reference genome files to download: {reference_genome_dir}")
+            reference_genome_bucket_files_future = executor.submit(
+                gcp_client.get_files_in_directory, reference_genome_dir,
+            )
+            fastq_gcp_paths = fastq_gcp_paths_future.result()
+            reference_genome_bucket_files = reference_genome_bucket_files_future.result()
 
         if fastq_gcp_paths:
             matching_path_string = "\n".join(str(path) for path in fastq_gcp_paths)
@@ -52,17 +68,15 @@ class DnaAlignJob(JobABC):
         )
         logging.info(f"The FASTQ paths have been paired up:\n{paired_fastqs_string}")
 
-        logging.info(f"Searching for reference genome files to download: {self.ref_genome_path.get_parent_directory()}")
-        reference_genome_bucket_files = gcp_client.get_files_in_directory(self.ref_genome_path.get_parent_directory())
         if reference_genome_bucket_files:
             reference_genome_files_string = "\n".join(str(path) for path in reference_genome_bucket_files)
             logging.info(f"Identified reference genome files to download:\n{reference_genome_files_string}")
         else:
             raise ValueError(f"Could not find reference genome paths matching the given path {self.ref_genome_path}")
 
-        logging.info("Starting download of input files")
-        gcp_file_cache.multiple_download_to_local(fastq_gcp_paths + reference_genome_bucket_files)
-        logging.info("Finished download of input files")
+        logging.info("Starting download of reference genome files")
+        gcp_file_cache.multiple_download_to_local(reference_genome_bucket_files)
+        logging.info("Finished download of reference genome files")
 
         self._do_alignment_locally(fastq_pairs, service_provider)
 
@@ -74,31 +88,87 @@ class DnaAlignJob(JobABC):
 
     def _do_alignment_locally(self, fastq_pairs: List[GCPFastqPair], service_provider: ServiceProviderABC) -> None:
         local_working_dir = service_provider.get_config().local_working_directory
-        create_or_cleanup_dir(local_working_dir)
-
-        local_lane_bams: List[Path] = []
-        for fastq_pair in fastq_pairs:
-            local_lane_bam = local_working_dir / f"{fastq_pair.pair_name}.bam"
-
-            logging.info(f"Start creating lane bam {local_lane_bam}")
-            self._do_lane_alignment_locally(fastq_pair, local_lane_bam, service_provider)
-            logging.info(f"Finished creating lane bam {local_lane_bam}")
-
-            local_lane_bams.append(local_lane_bam)
-
-        local_final_bam_path = service_provider.get_gcp_file_cache().get_local_path(self.output_path)
-        logging.info("Start merging lane bams")
-        self._merge_bams(local_lane_bams, local_final_bam_path, service_provider)
-        logging.info("Finished merging lane bams")
-
-        logging.info("Start creating index for merged bam")
-        self._index_bam(local_final_bam_path, service_provider)
-        logging.info("Finished creating index for merged bam")
+        with temporary_dir(local_working_dir):
+            # Download the FASTQ files of the next lanes while the current lanes are being aligned.
+            # The lanes are independent, so they can be aligned in parallel, each with a share of the CPUs.
+            gcp_file_cache = service_provider.get_gcp_file_cache()
+            parallel_lane_count = min(self.max_parallel_lane_count, len(fastq_pairs))
+            local_final_bam_path = gcp_file_cache.get_local_path(self.output_path)
+            local_lane_bams: List[Path]
+            lane_bam_compression_level: Optional[int]
+            if len(fastq_pairs) == 1:
+                # The only lane bam is the final bam, so write it there directly instead of moving it afterwards
+                local_lane_bams = [local_final_bam_path]
+                lane_bam_compression_level = None
+            else:
+                local_lane_bams = [local_working_dir / f"{fastq_pair.pair_name}.bam" for fastq_pair in fastq_pairs]
+                lane_bam_compression_level = self.INTERMEDIATE_LANE_BAM_COMPRESSION_LEVEL
+            download_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.FASTQ_PAIR_PREFETCH_COUNT)
+            alignment_executor = concurrent.futures.ThreadPoolExecutor(max_workers=parallel_lane_count)
+            with download_executor, alignment_executor:
+                download_futures = [
+                    download_executor.submit(
+                        gcp_file_cache.multiple_download_to_local, [fastq_pair.read1, fastq_pair.read2],
+                    )
+                    for fastq_pair in fastq_pairs
+                ]
+                alignment_futures = [
+                    alignment_executor.submit(
+                        self._do_lane_alignment_after_download,
+                        fastq_pair,
+                        download_future,
+                        local_lane_bam,
+                        parallel_lane_count,
+                        lane_bam_compression_level,
+                        service_provider,
+                    )
+                    for fastq_pair, download_future, local_lane_bam
+                    in zip(fastq_pairs, download_futures, local_lane_bams)
+                ]
+                try:
+                    for alignment_future in alignment_futures:
+                        alignment_future.result()
+                finally:
+                    # Don't start any more downloads or alignments if one of them failed
+                    for future in download_futures + alignment_futures:
+                        future.cancel()
+
+            if len(local_lane_bams) > 1:
+                logging.info("Start merging lane bams")
+                self._merge_bams(local_lane_bams, local_final_bam_path, service_provider)
+                logging.info("Finished merging lane bams")
+            else:
+                logging.info("Only one lane bam, so no merging needed.")
+
+            logging.info("Start creating index for merged bam")
+            self._index_bam(local_final_bam_path, service_provider)
+            logging.info("Finished creating index for merged bam")
+
+    def _do_lane_alignment_after_download(
+            self,
+            fastq_pair: GCPFastqPair,
+            download_future: "concurrent.futures.Future[None]",
+            local_lane_bam: Path,
+            parallel_lane_count: int,
+            lane_bam_compression_level: Optional[int],
+            service_provider: ServiceProviderABC,
+    ) -> None:
+        logging.info(f"Waiting for download of FASTQ pair {fastq_pair.pair_name}")
+        download_future.result()
 
-        create_or_cleanup_dir(local_working_dir)
+        logging.info(f"Start creating lane bam {local_lane_bam}")
+        self._do_lane_alignment_locally(
+            fastq_pair, local_lane_bam, parallel_lane_count, lane_bam_compression_level, service_provider,
+        )
+        logging.info(f"Finished creating lane bam {local_lane_bam}")
 
     def _do_lane_alignment_locally(
-            self, fastq_pair: GCPFastqPair, local_lane_bam: Path, service_provider: ServiceProviderABC,
+            self,
+            fastq_pair: GCPFastqPair,
+            local_lane_bam: Path,
+            parallel_lane_count: int,
+            lane_bam_compression_level: Optional[int],
+            service_provider: ServiceProviderABC,
     ) -> None:
         gcp_file_cache = service_provider.get_gcp_file_cache()
         local_fastq_pair = fastq_pair.get_local_version(gcp_file_cache)
@@ -113,16 +183,14 @@ class DnaAlignJob(JobABC):
             local_reference_genome_path,
             local_lane_bam,
             read_group_string,
+            parallel_lane_count,
+            lane_bam_compression_level,
         )
 
     def _merge_bams(
             self, local_lane_bams: List[Path], local_final_bam_path: Path, service_provider: ServiceProviderABC,
     ) -> None:
-        if len(local_lane_bams) == 1:
-            logging.info("Only one lane bam, so simply copy over this bam.")
-            shutil.move(str(local_lane_bams[0]), str(local_final_bam_path))
-        else:
-            service_provider.get_bash_toolbox().merge_bams(local_lane_bams, local_final_bam_path)
+        service_provider.get_bash_toolbox().merge_bams(local_lane_bams, local_final_bam_path)
 
     def _index_bam(self, local_final_bam_path: Path, service_provider: ServiceProviderABC) -> None:
         service_provider.get_bash_toolbox().create_bam_index(local_final_bam_path)
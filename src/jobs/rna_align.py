@@ -1,3 +1,4 @@
+import concurrent.futures
 import logging
 from dataclasses import dataclass
 from typing import List
@@ -6,7 +7,7 @@ from jobs.base import JobType, JobABC
 from jobs.util import FastqPairMatcher, GCPFastqPair
 from services.gcp.base import GCPPath
 from services.service_provider_abc import ServiceProviderABC
-from util import create_or_cleanup_dir
+from util import temporary_dir
 
 
 @dataclass(frozen=True)
@@ -33,7 +34,15 @@ class RnaAlignJob(JobABC):
             logging.info("Skipping job. Output file already exists in bucket")
             return
 
-        fastq_gcp_paths = gcp_client.get_matching_file_paths(self.input_path)
+        # Both listings are independent, so do them at the same time
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            fastq_gcp_paths_future = executor.submit(gcp_client.get_matching_file_paths, self.input_path)
+            logging.info(f"Searching for reference genome files to download: {self.ref_genome_resource_dir}")
+            reference_genome_bucket_files_future = executor.submit(
+                gcp_client.get_files_in_directory, self.ref_genome_resource_dir,
+            )
+            fastq_gcp_paths = fastq_gcp_paths_future.result()
+            reference_genome_bucket_files = reference_genome_bucket_files_future.result()
 
         if fastq_gcp_paths:
             matching_path_string = "\n".join(str(path) for path in fastq_gcp_paths)
@@ -47,8 +56,6 @@ class RnaAlignJob(JobABC):
         )
         logging.info(f"The FASTQ paths have been paired up:\n{paired_fastqs_string}")
 
-        logging.info(f"Searching for reference genome files to download: {self.ref_genome_resource_dir}")
-        reference_genome_bucket_files = gcp_client.get_files_in_directory(self.ref_genome_resource_dir)
         if reference_genome_bucket_files:
             reference_genome_files_string = "\n".join(str(path) for path in reference_genome_bucket_files)
             logging.info(f"Identified reference genome files to download:\n{reference_genome_files_string}")
@@ -70,28 +77,22 @@ class RnaAlignJob(JobABC):
 
     def _do_alignment_locally(self, fastq_pairs: List[GCPFastqPair], service_provider: ServiceProviderABC) -> None:
         local_working_dir = service_provider.get_config().local_working_directory
-        create_or_cleanup_dir(local_working_dir)
-
-        gcp_file_cache = service_provider.get_gcp_file_cache()
-        bash_tool_box = service_provider.get_bash_toolbox()
-        local_fastq_pairs = [pair.get_local_version(gcp_file_cache) for pair in fastq_pairs]
-        local_reference_resource_dir = gcp_file_cache.get_local_path(self.ref_genome_resource_dir)
-        local_final_bam_path = gcp_file_cache.get_local_path(self.output_path)
-
-        logging.info(f"Start creating unsorted bam")
-        local_unsorted_bam = bash_tool_box.align_rna_bam(
-            local_fastq_pairs,
-            local_reference_resource_dir,
-            local_working_dir,
-        )
-        logging.info(f"Finished creating unsorted bam {local_unsorted_bam}")
-
-        logging.info(f"Start sorting bam {local_unsorted_bam} to create {local_final_bam_path}")
-        bash_tool_box.sort_bam(local_unsorted_bam, local_final_bam_path)
-        logging.info(f"Finished sorting bam {local_unsorted_bam} to create {local_final_bam_path}")
-
-        logging.info(f"Start indexing bam {local_final_bam_path}")
-        bash_tool_box.create_bam_index(local_final_bam_path)
-        logging.info(f"Finished indexing bam {local_final_bam_path}")
-
-        create_or_cleanup_dir(local_working_dir)
+        with temporary_dir(local_working_dir):
+            gcp_file_cache = service_provider.get_gcp_file_cache()
+            bash_tool_box = service_provider.get_bash_toolbox()
+            local_fastq_pairs = [pair.get_local_version(gcp_file_cache) for pair in fastq_pairs]
+            local_reference_resource_dir = gcp_file_cache.get_local_path(self.ref_genome_resource_dir)
+            local_final_bam_path = gcp_file_cache.get_local_path(self.output_path)
+
+            logging.info(f"Start creating sorted bam {local_final_bam_path}")
+            bash_tool_box.align_rna_bam(
+                local_fastq_pairs,
+                local_reference_resource_dir,
+                local_working_dir,
+                local_final_bam_path,
+            )
+            logging.info(f"Finished creating sorted bam {local_final_bam_path}")
+
+            logging.info(f"Start indexing bam {local_final_bam_path}")
+            bash_tool_box.create_bam_index(local_final_bam_path)
+            logging.info(f"Finished indexing bam {local_final_bam_path}")
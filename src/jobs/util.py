@@ -1,19 +1,21 @@
+import operator
+import re
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import Dict, List
 
 from services.gcp.base import GCPPath
 from services.gcp.file_cache import GCPFileCache
 
 
-@dataclass(frozen=True, order=True)
+@dataclass(frozen=True)
 class LocalFastqPair(object):
     pair_name: str
     read1: Path
     read2: Path
 
 
-@dataclass(frozen=True, order=True)
+@dataclass(frozen=True)
 class GCPFastqPair(object):
     pair_name: str
     read1: GCPPath
@@ -26,39 +28,36 @@ class GCPFastqPair(object):
 
 
 class FastqPairMatcher(object):
-    READ1_FASTQ_SUBSTRING = "_R1_"
-    READ2_FASTQ_SUBSTRING = "_R2_"
+    READ_FASTQ_SUBSTRING_REGEX = re.compile(r"_R([12])_")
     READ_PAIR_FASTQ_SUBSTRING = "_R?_"
 
     def pair_up_gcp_fastq_paths(self, fastq_gcp_paths: List[GCPPath]) -> List[GCPFastqPair]:
-        pair_name_to_read1 = {}
-        pair_name_to_read2 = {}
+        pair_name_to_read1: Dict[str, GCPPath] = {}
+        pair_name_to_read2: Dict[str, GCPPath] = {}
 
         for fastq_gcp_path in fastq_gcp_paths:
-            fastq_file_name = fastq_gcp_path.relative_path.split("/")[-1]
-            read1_substring_count = fastq_file_name.count(self.READ1_FASTQ_SUBSTRING)
-            read2_substring_count = fastq_file_name.count(self.READ2_FASTQ_SUBSTRING)
+            fastq_file_name = fastq_gcp_path.relative_path.rpartition("/")[2]
+            read_match = self.READ_FASTQ_SUBSTRING_REGEX.search(fastq_file_name)
+            # Markers can share an underscore, as in '_R1_R2_', so look for a second one from the last underscore
+            if read_match is None or self.READ_FASTQ_SUBSTRING_REGEX.search(fastq_file_name, read_match.end() - 1):
+                raise ValueError(f"The FASTQ file is not marked clearly as read 1 or read 2: {fastq_gcp_path}")
 
-            if read1_substring_count == 1 and read2_substring_count == 0:
-                pair_name = fastq_file_name.replace(
-                    self.READ1_FASTQ_SUBSTRING, self.READ_PAIR_FASTQ_SUBSTRING,
-                ).split(".")[0]
+            before_marker = fastq_file_name[:read_match.start()]
+            after_marker = fastq_file_name[read_match.end():]
+            pair_name = (before_marker + self.READ_PAIR_FASTQ_SUBSTRING + after_marker).split(".", 1)[0]
+            if read_match.group(1) == "1":
                 pair_name_to_read1[pair_name] = fastq_gcp_path
-            elif read1_substring_count == 0 and read2_substring_count == 1:
-                pair_name = fastq_file_name.replace(
-                    self.READ2_FASTQ_SUBSTRING, self.READ_PAIR_FASTQ_SUBSTRING,
-                ).split(".")[0]
-                pair_name_to_read2[pair_name] = fastq_gcp_path
             else:
-                raise ValueError(f"The FASTQ file is not marked clearly as read 1 or read 2: {fastq_gcp_path}")
+                pair_name_to_read2[pair_name] = fastq_gcp_path
 
-        if set(pair_name_to_read1.keys()) != set(pair_name_to_read2.keys()):
+        if pair_name_to_read1.keys() != pair_name_to_read2.keys():
             raise ValueError(f"Not all FASTQ files can be matched up in proper pairs of read 1 and read 2")
 
         fastq_pairs = [
-            GCPFastqPair(pair_name, pair_name_to_read1[pair_name], pair_name_to_read2[pair_name])
-            for pair_name in pair_name_to_read1.keys()
+            GCPFastqPair(pair_name, read1, pair_name_to_read2[pair_name])
+            for pair_name, read1 in pair_name_to_read1.items()
         ]
-        fastq_pairs.sort()
+        # Pair names are unique, so there is no need to compare the paths as well
+        fastq_pairs.sort(key=operator.attrgetter("pair_name"))
 
         return fastq_pairs
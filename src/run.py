@@ -3,6 +3,7 @@ import sys
 from typing import List
 
 from config import Config
+from jobs.base import JobABC, JobType
 from services.service_provider import ServiceProvider
 from util import set_up_logging
 
@@ -18,13 +19,30 @@ def main(arguments: List[str]) -> None:
     jobs = service_provider.get_argument_parser().extract_jobs(" ".join(arguments))
 
     if jobs:
-        for job in jobs:
-            job.execute(service_provider)
+        # Set up the GCP client before the first job, so authentication problems surface before any work is done
+        service_provider.get_gcp_client()
+        run_jobs(jobs, service_provider)
     else:
         logging.warning("No jobs detected.")
 
     logging.info("Finished k8analysis.")
 
 
+def run_jobs(jobs: List[JobABC], service_provider: ServiceProvider) -> None:
+    bash_toolbox = service_provider.get_bash_toolbox()
+    rna_align_job_indices = [index for index, job in enumerate(jobs) if job.get_job_type() == JobType.RNA_ALIGN]
+    # Only keep STAR genomes in shared memory if there is a later RNA alignment to reuse them,
+    # and remove them right after the last RNA alignment, so they don't take up memory during the other jobs
+    bash_toolbox.set_star_genome_sharing(len(rna_align_job_indices) > 1)
+    last_rna_align_job_index = max(rna_align_job_indices, default=-1)
+    try:
+        for index, job in enumerate(jobs):
+            job.execute(service_provider)
+            if index == last_rna_align_job_index:
+                bash_toolbox.remove_shared_star_genomes()
+    finally:
+        bash_toolbox.remove_shared_star_genomes()
+
+
 if __name__ == '__main__':
     main(sys.argv[1:])
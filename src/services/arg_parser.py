@@ -1,9 +1,11 @@
 import argparse
+import collections
+import functools
 import logging
-import re
 import shlex
+import string
 from dataclasses import dataclass
-from typing import List, Pattern
+from typing import Callable, Dict, FrozenSet, List
 
 from jobs.dna_align import DnaAlignJob
 from jobs.base import JobType, JobABC
@@ -14,6 +16,68 @@ from jobs.rna_align import RnaAlignJob
 from jobs.umi_dedup import UmiDedupJob
 from services.gcp.base import GCPPath
 
+FASTQ_INPUT_HELP = (
+    "Wildcard path to the fastqs files that will be aligned, e.g. 'gs://some-kind/of/path*.fastq.gz'. "
+    "Make sure that for each read pair the file path for read 1 contains '_R1_' exactly once and "
+    "'_R2_' zero times, and that the file path for read 2 contains '_R2_' exactly once and '_R1_' zero times."
+)
+DNA_REF_GENOME_HELP = (
+    "Reference genome version to align to. "
+    "Either '37', '38', or some GCP bucket path to a FASTA file, e.g. 'gs://some/kind/of/path'."
+)
+ALIGNED_BAM_OUTPUT_HELP = (
+    "Path in bucket to which the bam will be written, e.g. 'gs://some-other-kind/of/path.bam'. "
+    "Will also output an index file, e.g. 'gs://some-other-kind/of/path.bam.bai'."
+)
+COUNT_MAPPING_COORDS_INPUT_HELP = (
+    "Path to the bam file of which mapping coordinates will be counted, e.g. gs://some-kind/of/path.bam ."
+    "Make sure that an index file is also available, e.g. gs://some-kind/of/path.bam.bai ."
+)
+COUNT_MAPPING_COORDS_OUTPUT_HELP = (
+    "Path in bucket to which count will be uploaded, e.g. gs://some-other-kind/of/path.txt ."
+)
+FLAGSTAT_INPUT_HELP = (
+    "Path to the bam file on which sambamba flagstat will be run, e.g. gs://some-kind/of/path.bam ."
+    "Make sure that an index file is also available, e.g. gs://some-kind/of/path.bam.bai ."
+)
+FLAGSTAT_OUTPUT_HELP = (
+    "Path in bucket to which flagstat file will be written, e.g. gs://some-other-kind/of/path.flagstat ."
+)
+DEDUP_INPUT_HELP = (
+    "Path to the bam file on which deduplication will be run, e.g. gs://some-kind/of/path.bam ."
+    "Make sure that an index file is also available, e.g. gs://some-kind/of/path.bam.bai ."
+)
+DEDUP_OUTPUT_HELP = (
+    "Path in bucket to which the deduplicated bam will be written, e.g. gs://some-other-kind/of/path.bam ."
+    "Will also output an index file, e.g. gs://some-other-kind/of/path.bam.bai ."
+)
+MAX_PARALLEL_LANES_HELP = (
+    "Maximum number of lanes that are aligned at the same time, each with an equal share of the CPUs. Default: 1. "
+    "Every parallel alignment loads the full reference genome index into memory."
+)
+RNA_REF_GENOME_HELP = (
+    "Reference genome version to align to. Either '37', '38'."
+)
+
+
+@dataclass(frozen=True)
+class BucketPathFormat(object):
+    """Format of GCP bucket paths, checked with a single pass over the characters instead of a regex."""
+    allowed_characters: FrozenSet[str]
+    allowed_characters_description: str
+    suffix: str = ""
+
+    PREFIX = "gs://"
+
+    def matches(self, value: str) -> bool:
+        if not value.startswith(self.PREFIX) or not value.endswith(self.suffix):
+            return False
+        path_characters = value[len(self.PREFIX):len(value) - len(self.suffix)]
+        return bool(path_characters) and self.allowed_characters.issuperset(path_characters)
+
+    def __str__(self) -> str:
+        return f"{self.PREFIX}[{self.allowed_characters_description}]+{self.suffix}"
+
 
 @dataclass(frozen=True)
 class ArgumentParser(object):
@@ -29,247 +93,217 @@ class ArgumentParser(object):
     )
     REF_GENOME_37_STAR_RESOURCES_BUCKET_PATH = "gs://hmf-crunch-resources/rna/star/37"
     REF_GENOME_38_STAR_RESOURCES_BUCKET_PATH = "gs://hmf-crunch-resources/rna/star/38"
-
-    BUCKET_PATH_REGEX = re.compile(r"^gs://[a-zA-Z0-9/._\-]+$")
-    BAM_BUCKET_PATH_REGEX = re.compile(r"^gs://[a-zA-Z0-9/._\-]+\.bam$")
-    FLAGSTAT_BUCKET_PATH_REGEX = re.compile(r"^gs://[a-zA-Z0-9/._\-]+\.flagstat$")
-    TXT_BUCKET_PATH_REGEX = re.compile(r"^gs://[a-zA-Z0-9/._\-]+\.txt$")
-    WILDCARD_FASTQ_BUCKET_PATH_REGEX = re.compile(r"^gs://[a-zA-Z0-9*/._\[\]\-]+\.fastq\.gz$")
+    REF_GENOME_ARGUMENT_TO_FASTA_BUCKET_PATH = {
+        REF_GENOME_37_ARGUMENT: REF_GENOME_37_FASTA_BUCKET_PATH,
+        REF_GENOME_38_ARGUMENT: REF_GENOME_38_FASTA_BUCKET_PATH,
+    }
+    REF_GENOME_ARGUMENT_TO_STAR_RESOURCES_BUCKET_PATH = {
+        REF_GENOME_37_ARGUMENT: REF_GENOME_37_STAR_RESOURCES_BUCKET_PATH,
+        REF_GENOME_38_ARGUMENT: REF_GENOME_38_STAR_RESOURCES_BUCKET_PATH,
+    }
+
+    BUCKET_PATH_CHARACTERS = frozenset(string.ascii_letters + string.digits + "/._-")
+    WILDCARD_BUCKET_PATH_CHARACTERS = BUCKET_PATH_CHARACTERS | frozenset("*[]")
+
+    BUCKET_PATH_FORMAT = BucketPathFormat(BUCKET_PATH_CHARACTERS, "a-zA-Z0-9/._-")
+    BAM_BUCKET_PATH_FORMAT = BucketPathFormat(BUCKET_PATH_CHARACTERS, "a-zA-Z0-9/._-", ".bam")
+    FLAGSTAT_BUCKET_PATH_FORMAT = BucketPathFormat(BUCKET_PATH_CHARACTERS, "a-zA-Z0-9/._-", ".flagstat")
+    TXT_BUCKET_PATH_FORMAT = BucketPathFormat(BUCKET_PATH_CHARACTERS, "a-zA-Z0-9/._-", ".txt")
+    WILDCARD_FASTQ_BUCKET_PATH_FORMAT = BucketPathFormat(
+        WILDCARD_BUCKET_PATH_CHARACTERS, "a-zA-Z0-9*/._[]-", ".fastq.gz",
+    )
 
     def extract_jobs(self, arguments_string: str) -> List[JobABC]:
-        arguments = shlex.split(arguments_string)
+        arguments = collections.deque(shlex.split(arguments_string))
+        job_type_names = JobType.get_type_names()
 
         jobs: List[JobABC] = []
         while arguments:
-            job_type = self._get_job_type(arguments.pop(0))
+            job_type = self._get_job_type(arguments.popleft())
             logging.info(f"Detected job of type: {job_type.get_job_name()}.")
             job_args: List[str] = []
-            while arguments and arguments[0] not in JobType.get_type_names():
-                job_args.append(arguments.pop(0))
+            while arguments and arguments[0] not in job_type_names:
+                job_args.append(arguments.popleft())
             job = self._parse_job(job_type, job_args)
             jobs.append(job)
 
         return jobs
 
     def _parse_job(self, job_type: JobType, job_args: List[str]) -> JobABC:
-        job: JobABC
-        if job_type == JobType.DNA_ALIGN:
-            job = self._parse_dna_align_job(job_args)
-        elif job_type == JobType.COUNT_MAPPING_COORDS:
-            job = self._parse_count_mapping_coords_job(job_args)
-        elif job_type == JobType.FLAGSTAT:
-            job = self._parse_flagstat_job(job_args)
-        elif job_type == JobType.NON_UMI_DEDUP:
-            job = self._parse_non_umi_dedup_job(job_args)
-        elif job_type == JobType.RNA_ALIGN:
-            job = self._parse_rna_align_job(job_args)
-        elif job_type == JobType.UMI_DEDUP:
-            job = self._parse_umi_dedup_job(job_args)
-        else:
+        parse_method = self._get_job_type_to_parse_method().get(job_type)
+        if parse_method is None:
             raise NotImplementedError(f"Unimplemented job type: {job_type}.")
-        return job
+        return parse_method(job_args)
+
+    @functools.lru_cache(maxsize=None)
+    def _get_job_type_to_parse_method(self) -> Dict[JobType, Callable[[List[str]], JobABC]]:
+        return {
+            JobType.COUNT_MAPPING_COORDS: self._parse_count_mapping_coords_job,
+            JobType.DNA_ALIGN: self._parse_dna_align_job,
+            JobType.FLAGSTAT: self._parse_flagstat_job,
+            JobType.NON_UMI_DEDUP: self._parse_non_umi_dedup_job,
+            JobType.RNA_ALIGN: self._parse_rna_align_job,
+            JobType.UMI_DEDUP: self._parse_umi_dedup_job,
+        }
 
     def _parse_dna_align_job(self, job_args: List[str]) -> DnaAlignJob:
+        parsed_args = self._get_dna_align_parser().parse_args(job_args)
+        return DnaAlignJob(
+            parsed_args.input, parsed_args.ref_genome, parsed_args.output, parsed_args.max_parallel_lanes,
+        )
+
+    @functools.lru_cache(maxsize=None)
+    def _get_dna_align_parser(self) -> argparse.ArgumentParser:
         parser = argparse.ArgumentParser(
             prog=JobType.DNA_ALIGN.get_job_name(),
             description="Run bwa mem alignment of paired reads at GCP.",
         )
-        input_help = (
-            "Wildcard path to the fastqs files that will be aligned, e.g. 'gs://some-kind/of/path*.fastq.gz'. "
-            "Make sure that for each read pair the file path for read 1 contains '_R1_' exactly once and "
-            "'_R2_' zero times, and that the file path for read 2 contains '_R2_' exactly once and '_R1_' zero times."
-        )
-        ref_genome_help = (
-            "Reference genome version to align to. "
-            "Either '37', '38', or some GCP bucket path to a FASTA file, e.g. 'gs://some/kind/of/path'."
-        )
-        output_help = (
-            "Path in bucket to which the bam will be written, e.g. 'gs://some-other-kind/of/path.bam'. "
-            "Will also output an index file, e.g. 'gs://some-other-kind/of/path.bam.bai'."
+        parser.add_argument(
+            "--input", "-i", type=self._parse_wildcard_fastq_gcp_path, required=True, help=FASTQ_INPUT_HELP,
         )
         parser.add_argument(
-            "--input", "-i", type=self._parse_wildcard_fastq_gcp_path, required=True, help=input_help,
+            "--ref-genome", "-r", type=self._parse_dna_reference_genome_value, required=True, help=DNA_REF_GENOME_HELP,
         )
         parser.add_argument(
-            "--ref-genome", "-r", type=self._parse_dna_reference_genome_value, required=True, help=ref_genome_help,
+            "--output", "-o", type=self._parse_bam_gcp_path, required=True, help=ALIGNED_BAM_OUTPUT_HELP,
         )
         parser.add_argument(
-            "--output", "-o", type=self._parse_bam_gcp_path, required=True, help=output_help,
+            "--max-parallel-lanes", type=self._parse_positive_integer, default=1, help=MAX_PARALLEL_LANES_HELP,
         )
 
-        parsed_args = parser.parse_args(job_args)
-
-        return DnaAlignJob(parsed_args.input, parsed_args.ref_genome, parsed_args.output)
+        return parser
 
     def _parse_count_mapping_coords_job(self, job_args: List[str]) -> CountMappingCoordsJob:
+        parsed_args = self._get_count_mapping_coords_parser().parse_args(job_args)
+        return CountMappingCoordsJob(parsed_args.input, parsed_args.output)
+
+    @functools.lru_cache(maxsize=None)
+    def _get_count_mapping_coords_parser(self) -> argparse.ArgumentParser:
         parser = argparse.ArgumentParser(
             prog=JobType.COUNT_MAPPING_COORDS.get_job_name(),
             description="Count mapping coordinates at GCP.",
         )
-        input_help = (
-            "Path to the bam file of which mapping coordinates will be counted, e.g. gs://some-kind/of/path.bam ."
-            "Make sure that an index file is also available, e.g. gs://some-kind/of/path.bam.bai ."
-        )
-        output_help = (
-            "Path in bucket to which count will be uploaded, e.g. gs://some-other-kind/of/path.txt ."
-        )
         parser.add_argument(
-            "--input", "-i", type=self._parse_bam_gcp_path, required=True, help=input_help,
+            "--input", "-i", type=self._parse_bam_gcp_path, required=True, help=COUNT_MAPPING_COORDS_INPUT_HELP,
         )
         parser.add_argument(
-            "--output", "-o", type=self._parse_txt_gcp_path, required=True, help=output_help,
+            "--output", "-o", type=self._parse_txt_gcp_path, required=True, help=COUNT_MAPPING_COORDS_OUTPUT_HELP,
         )
 
-        parsed_args = parser.parse_args(job_args)
-
-        return CountMappingCoordsJob(parsed_args.input, parsed_args.output)
+        return parser
 
     def _parse_flagstat_job(self, job_args: List[str]) -> FlagstatJob:
+        parsed_args = self._get_flagstat_parser().parse_args(job_args)
+        return FlagstatJob(parsed_args.input, parsed_args.output)
+
+    @functools.lru_cache(maxsize=None)
+    def _get_flagstat_parser(self) -> argparse.ArgumentParser:
         parser = argparse.ArgumentParser(
             prog=JobType.FLAGSTAT.get_job_name(),
             description="Run sambamba flagstat at GCP.",
         )
-        input_help = (
-            "Path to the bam file on which sambamba flagstat will be run, e.g. gs://some-kind/of/path.bam ."
-            "Make sure that an index file is also available, e.g. gs://some-kind/of/path.bam.bai ."
-        )
-        output_help = (
-            "Path in bucket to which flagstat file will be written, e.g. gs://some-other-kind/of/path.flagstat ."
-        )
         parser.add_argument(
-            "--input", "-i", type=self._parse_bam_gcp_path, required=True, help=input_help,
+            "--input", "-i", type=self._parse_bam_gcp_path, required=True, help=FLAGSTAT_INPUT_HELP,
         )
         parser.add_argument(
-            "--output", "-o", type=self._parse_flagstat_gcp_path, required=True, help=output_help,
+            "--output", "-o", type=self._parse_flagstat_gcp_path, required=True, help=FLAGSTAT_OUTPUT_HELP,
         )
 
-        parsed_args = parser.parse_args(job_args)
-
-        return FlagstatJob(parsed_args.input, parsed_args.output)
+        return parser
 
     def _parse_non_umi_dedup_job(self, job_args: List[str]) -> NonUmiDedupJob:
+        parsed_args = self._get_non_umi_dedup_parser().parse_args(job_args)
+        return NonUmiDedupJob(parsed_args.input, parsed_args.output)
+
+    @functools.lru_cache(maxsize=None)
+    def _get_non_umi_dedup_parser(self) -> argparse.ArgumentParser:
         parser = argparse.ArgumentParser(
             prog=JobType.NON_UMI_DEDUP.get_job_name(),
             description="Run sambamba markdup at GCP.",
         )
-        input_help = (
-            "Path to the bam file on which deduplication will be run, e.g. gs://some-kind/of/path.bam ."
-            "Make sure that an index file is also available, e.g. gs://some-kind/of/path.bam.bai ."
-        )
-        output_help = (
-            "Path in bucket to which the deduplicated bam will be written, e.g. gs://some-other-kind/of/path.bam ."
-            "Will also output an index file, e.g. gs://some-other-kind/of/path.bam.bai ."
-        )
         parser.add_argument(
-            "--input", "-i", type=self._parse_bam_gcp_path, required=True, help=input_help,
+            "--input", "-i", type=self._parse_bam_gcp_path, required=True, help=DEDUP_INPUT_HELP,
         )
         parser.add_argument(
-            "--output", "-o", type=self._parse_bam_gcp_path, required=True, help=output_help,
+            "--output", "-o", type=self._parse_bam_gcp_path, required=True, help=DEDUP_OUTPUT_HELP,
         )
 
-        parsed_args = parser.parse_args(job_args)
-
-        return NonUmiDedupJob(parsed_args.input, parsed_args.output)
+        return parser
 
     def _parse_rna_align_job(self, job_args: List[str]) -> RnaAlignJob:
+        parsed_args = self._get_rna_align_parser().parse_args(job_args)
+        return RnaAlignJob(parsed_args.input, parsed_args.ref_genome, parsed_args.output)
+
+    @functools.lru_cache(maxsize=None)
+    def _get_rna_align_parser(self) -> argparse.ArgumentParser:
         parser = argparse.ArgumentParser(
             prog=JobType.RNA_ALIGN.get_job_name(),
             description="Run STAR alignment of paired RNA reads at GCP.",
         )
-        input_help = (
-            "Wildcard path to the fastqs files that will be aligned, e.g. 'gs://some-kind/of/path*.fastq.gz'. "
-            "Make sure that for each read pair the file path for read 1 contains '_R1_' exactly once and "
-            "'_R2_' zero times, and that the file path for read 2 contains '_R2_' exactly once and '_R1_' zero times."
-        )
-        ref_genome_help = (
-            "Reference genome version to align to. Either '37', '38'."
-        )
-        output_help = (
-            "Path in bucket to which the bam will be written, e.g. 'gs://some-other-kind/of/path.bam'. "
-            "Will also output an index file, e.g. 'gs://some-other-kind/of/path.bam.bai'."
-        )
         parser.add_argument(
-            "--input", "-i", type=self._parse_wildcard_fastq_gcp_path, required=True, help=input_help,
+            "--input", "-i", type=self._parse_wildcard_fastq_gcp_path, required=True, help=FASTQ_INPUT_HELP,
         )
         parser.add_argument(
-            "--ref-genome", "-r", type=self._parse_rna_reference_genome_value, required=True, help=ref_genome_help,
+            "--ref-genome", "-r", type=self._parse_rna_reference_genome_value, required=True, help=RNA_REF_GENOME_HELP,
         )
         parser.add_argument(
-            "--output", "-o", type=self._parse_bam_gcp_path, required=True, help=output_help,
+            "--output", "-o", type=self._parse_bam_gcp_path, required=True, help=ALIGNED_BAM_OUTPUT_HELP,
         )
 
-        parsed_args = parser.parse_args(job_args)
-
-        return RnaAlignJob(parsed_args.input, parsed_args.ref_genome, parsed_args.output)
+        return parser
 
     def _parse_umi_dedup_job(self, job_args: List[str]) -> UmiDedupJob:
+        parsed_args = self._get_umi_dedup_parser().parse_args(job_args)
+        return UmiDedupJob(parsed_args.input, parsed_args.output)
+
+    @functools.lru_cache(maxsize=None)
+    def _get_umi_dedup_parser(self) -> argparse.ArgumentParser:
         parser = argparse.ArgumentParser(
             prog=JobType.UMI_DEDUP.get_job_name(),
             description="Run UMI-Collapse dedupping at GCP.",
         )
-        input_help = (
-            "Path to the bam file on which deduplication will be run, e.g. gs://some-kind/of/path.bam ."
-            "Make sure that an index file is also available, e.g. gs://some-kind/of/path.bam.bai ."
-        )
-        output_help = (
-            "Path in bucket to which the deduplicated bam will be written, e.g. gs://some-other-kind/of/path.bam ."
-            "Will also output an index file, e.g. gs://some-other-kind/of/path.bam.bai ."
-        )
         parser.add_argument(
-            "--input", "-i", type=self._parse_bam_gcp_path, required=True, help=input_help,
+            "--input", "-i", type=self._parse_bam_gcp_path, required=True, help=DEDUP_INPUT_HELP,
         )
         parser.add_argument(
-            "--output", "-o", type=self._parse_bam_gcp_path, required=True, help=output_help,
+            "--output", "-o", type=self._parse_bam_gcp_path, required=True, help=DEDUP_OUTPUT_HELP,
         )
 
-        parsed_args = parser.parse_args(job_args)
-
-        return UmiDedupJob(parsed_args.input, parsed_args.output)
+        return parser
 
     def _parse_wildcard_fastq_gcp_path(self, arg_value: str) -> GCPPath:
-        self._assert_argument_matches_regex(arg_value, self.WILDCARD_FASTQ_BUCKET_PATH_REGEX)
+        self._assert_argument_matches_format(arg_value, self.WILDCARD_FASTQ_BUCKET_PATH_FORMAT)
         return GCPPath.from_string(arg_value)
 
     def _parse_bam_gcp_path(self, arg_value: str) -> GCPPath:
-        self._assert_argument_matches_regex(arg_value, self.BAM_BUCKET_PATH_REGEX)
+        self._assert_argument_matches_format(arg_value, self.BAM_BUCKET_PATH_FORMAT)
         return GCPPath.from_string(arg_value)
 
     def _parse_flagstat_gcp_path(self, arg_value: str) -> GCPPath:
-        self._assert_argument_matches_regex(arg_value, self.FLAGSTAT_BUCKET_PATH_REGEX)
+        self._assert_argument_matches_format(arg_value, self.FLAGSTAT_BUCKET_PATH_FORMAT)
         return GCPPath.from_string(arg_value)
 
     def _parse_txt_gcp_path(self, arg_value: str) -> GCPPath:
-        self._assert_argument_matches_regex(arg_value, self.TXT_BUCKET_PATH_REGEX)
+        self._assert_argument_matches_format(arg_value, self.TXT_BUCKET_PATH_FORMAT)
         return GCPPath.from_string(arg_value)
 
     def _parse_dna_reference_genome_value(self, arg_value: str) -> GCPPath:
-        arg_value_format_recognized = (
-            arg_value == self.REF_GENOME_37_ARGUMENT
-            or arg_value == self.REF_GENOME_38_ARGUMENT
-            or self.BUCKET_PATH_REGEX.match(arg_value)
-        )
-        if not arg_value_format_recognized:
+        bucket_fasta_path = self.REF_GENOME_ARGUMENT_TO_FASTA_BUCKET_PATH.get(arg_value)
+        if bucket_fasta_path is not None:
+            return GCPPath.from_string(bucket_fasta_path)
+
+        # arg_value should itself be a GCP bucket path
+        if not self.BUCKET_PATH_FORMAT.matches(arg_value):
             error_msg = (
                 f"Value '{arg_value}' does not match '{self.REF_GENOME_37_ARGUMENT}', '{self.REF_GENOME_38_ARGUMENT}' "
-                f"or regex '{self.BUCKET_PATH_REGEX.pattern}'."
+                f"or format '{self.BUCKET_PATH_FORMAT}'."
             )
             raise argparse.ArgumentTypeError(error_msg)
-
-        if arg_value == self.REF_GENOME_37_ARGUMENT:
-            bucket_fasta_path = self.REF_GENOME_37_FASTA_BUCKET_PATH
-        elif arg_value == self.REF_GENOME_38_ARGUMENT:
-            bucket_fasta_path = self.REF_GENOME_38_FASTA_BUCKET_PATH
-        else:
-            # arg_value is itself a GCP bucket path
-            bucket_fasta_path = arg_value
-        return GCPPath.from_string(bucket_fasta_path)
+        return GCPPath.from_string(arg_value)
 
     def _parse_rna_reference_genome_value(self, arg_value: str) -> GCPPath:
-        if arg_value == self.REF_GENOME_37_ARGUMENT:
-            bucket_path = self.REF_GENOME_37_STAR_RESOURCES_BUCKET_PATH
-        elif arg_value == self.REF_GENOME_38_ARGUMENT:
-            bucket_path = self.REF_GENOME_38_STAR_RESOURCES_BUCKET_PATH
-        else:
+        bucket_path = self.REF_GENOME_ARGUMENT_TO_STAR_RESOURCES_BUCKET_PATH.get(arg_value)
+        if bucket_path is None:
             error_msg = (
                 f"Value '{arg_value}' does not match "
                 f"'{self.REF_GENOME_37_ARGUMENT}' or '{self.REF_GENOME_38_ARGUMENT}'."
@@ -277,15 +311,27 @@ class ArgumentParser(object):
             raise argparse.ArgumentTypeError(error_msg)
         return GCPPath.from_string(bucket_path)
 
-    def _assert_argument_matches_regex(self, arg_value: str, pattern: Pattern[str]) -> None:
-        if not pattern.match(arg_value):
-            error_msg = f"Value '{arg_value}' does not match the regex pattern '{pattern.pattern}'."
+    def _parse_positive_integer(self, arg_value: str) -> int:
+        try:
+            value = int(arg_value)
+        except ValueError:
+            value = 0
+        if value < 1:
+            raise argparse.ArgumentTypeError(f"Value '{arg_value}' is not a positive integer.")
+        return value
+
+    def _assert_argument_matches_format(self, arg_value: str, path_format: BucketPathFormat) -> None:
+        if not path_format.matches(arg_value):
+            error_msg = f"Value '{arg_value}' does not match the format '{path_format}'."
             raise argparse.ArgumentTypeError(error_msg)
 
     def _get_job_type(self, job_type_arg: str) -> JobType:
         try:
             job_type = JobType[job_type_arg.upper()]
         except KeyError:
-            error_msg = f"Unrecognized job name '{job_type_arg}'. Recognized job names: {JobType.get_type_names()}"
+            error_msg = (
+                f"Unrecognized job name '{job_type_arg}'. "
+                f"Recognized job names: {sorted(JobType.get_type_names())}"
+            )
             raise ValueError(error_msg)
         return job_type
@@ -1,36 +1,52 @@
+import collections
+import functools
 import logging
 import math
-import multiprocessing
 import shlex
+import shutil
 import subprocess
-from dataclasses import dataclass
+import tempfile
+import threading
 from pathlib import Path
-from typing import List, Optional, Tuple, Union, TextIO
+from typing import Deque, List, Optional, Set, Tuple, Union, TextIO
 
 from jobs.util import LocalFastqPair
-from util import create_parent_dir_if_not_exists
-
-
-@dataclass(frozen=True)
-class BashCommandResults(object):
-    output: Optional[str]
-    errors: Optional[str]
-    status: int
+from util import create_parent_dir_if_not_exists, get_available_cpu_count
 
 
 class BashToolbox(object):
     """Class for running and combining bash commands and tools"""
     GSUTIL = "gsutil"
     JAVA = "java"
+    # Decompresses faster than zcat, since checksum calculation, reading and writing are done on separate threads
+    PIGZ = "pigz"
+    # Decompresses gzip even faster than pigz with SIMD instructions, but is not available in every image
+    IGZIP = "igzip"
     BWA = Path.home() / "bwa"
+    BWA_MEM2 = Path.home() / "bwa-mem2-2.2.1_x64-linux" / "bwa-mem2"
     SAMBAMBA = Path.home() / "sambamba"
     STAR = Path.home() / "STAR-2.7.3a" / "bin" / "Linux_x86_64_static" / "STAR"
     UMI_COLLAPSE_JAR = Path.home() / "UMICollapse" / "umicollapse.jar"
 
     SAMBAMBA_MARKDUP_OVERFLOW_LIST_SIZE = 4500000
     STAR_MAXIMUM_THREAD_USAGE_FACTOR = 0.75
+    # Sambamba stops getting faster at around this many threads, and extra threads only compete with other tools
+    SAMBAMBA_MAXIMUM_THREAD_COUNT = 8
+    # Memory for sort before it spills to temporary files, which are written next to the output instead of to /tmp
+    SORT_BUFFER_SIZE = "2G"
+    # bwa-mem2 is a faster drop-in replacement for bwa mem, but needs its own index files next to the reference genome
+    BWA_MEM2_INDEX_SUFFIXES = (".0123", ".bwt.2bit.64")
 
     OUTPUT_ENCODING = "utf-8"
+    MAX_KEPT_ERROR_LINES = 100
+
+    # Tools run with a lower CPU and IO priority than this process, so they can't starve the threads
+    # that download and upload files at the same time. Lowering priority needs no extra privileges.
+    TOOL_PRIORITY_PREFIX = ["nice", "-n", "5", "ionice", "-c", "2", "-n", "7"]
+
+    def __init__(self) -> None:
+        self._star_genome_sharing_enabled = False
+        self._star_genome_dirs_in_shared_memory: Set[Path] = set()
 
     def align_dna_bam(
             self,
@@ -38,181 +54,270 @@ class BashToolbox(object):
             local_reference_genome_path: Path,
             local_output_bam_path: Path,
             read_group_string: str,
+            parallel_alignment_count: int = 1,
+            compression_level: Optional[int] = None,
     ) -> None:
-        thread_count = self._get_thread_count()
-        bwa_align_command = (
-            f'"{self.BWA}" mem -Y -t {thread_count} -R "{read_group_string}" "{local_reference_genome_path}" '
-            f'"{local_fastq_pair.read1}" "{local_fastq_pair.read2}"'
-        )
-        sam_to_bam_command = f'"{self.SAMBAMBA}" view -f "bam" -S -l 0 "/dev/stdin"'
-        bam_sort_command = f'"{self.SAMBAMBA}" sort -o "{local_output_bam_path}" "/dev/stdin"'
-        combined_command = " | ".join([bwa_align_command, sam_to_bam_command, bam_sort_command])
+        # Share the CPUs with the other alignments that are running at the same time
+        thread_count = max(self._get_thread_count() // parallel_alignment_count, 1)
+        bwa_mem_tool = self._get_bwa_mem_tool(local_reference_genome_path)
+        bwa_align_command = [
+            str(bwa_mem_tool), "mem", "-Y", "-t", str(thread_count), "-R", read_group_string,
+            str(local_reference_genome_path), str(local_fastq_pair.read1), str(local_fastq_pair.read2),
+        ]
+        sambamba_thread_count = min(thread_count, self.SAMBAMBA_MAXIMUM_THREAD_COUNT)
+        sam_to_bam_command = [
+            str(self.SAMBAMBA), "view", "-t", str(sambamba_thread_count), "-f", "bam", "-S", "-l", "0", "/dev/stdin",
+        ]
+        bam_sort_command = [
+            str(self.SAMBAMBA), "sort", "-t", str(sambamba_thread_count), "-o", str(local_output_bam_path),
+        ]
+        if compression_level is not None:
+            bam_sort_command.extend(["-l", str(compression_level)])
+        bam_sort_command.append("/dev/stdin")
 
         create_parent_dir_if_not_exists(local_output_bam_path)
-        self._run_bash_command(combined_command)
+        self._run_bash_command([bwa_align_command, sam_to_bam_command, bam_sort_command])
 
     def align_rna_bam(
             self,
             local_fastq_pairs: List[LocalFastqPair],
             local_reference_resource_dir: Path,
             local_working_dir: Path,
-    ) -> Path:
-        star_thread_count = max(math.floor(self.STAR_MAXIMUM_THREAD_USAGE_FACTOR * self._get_thread_count()), 1)
-
-        r1_files = ",".join(f'"{pair.read1}"' for pair in local_fastq_pairs)
-        r2_files = ",".join(f'"{pair.read2}"' for pair in local_fastq_pairs)
-        star_align_command = (
-            f'"{self.STAR}" '
-            f'--runThreadN {star_thread_count} '
-            f'--genomeDir "{local_reference_resource_dir}" '
-            f'--genomeLoad NoSharedMemory '
-            f'--readFilesIn {r1_files} {r2_files} '
-            f'--readFilesCommand zcat '
-            f'--outSAMtype BAM Unsorted '
-            f'--outSAMunmapped Within '
-            f'--outBAMcompression 0 '
-            f'--outSAMattributes All '
-            f'--outFilterMultimapNmax 10 '
-            f'--outFilterMismatchNmax 3 limitOutSJcollapsed 3000000 '
-            f'--chimSegmentMin 10 '
-            f'--chimOutType WithinBAM SoftClip '
-            f'--chimJunctionOverhangMin 10 '
-            f'--chimSegmentReadGapMax 3 '
-            f'--chimScoreMin 1 '
-            f'--chimScoreDropMax 30 '
-            f'--chimScoreJunctionNonGTAG 0 '
-            f'--chimScoreSeparation 1 '
-            f'--outFilterScoreMinOverLread 0.33 '
-            f'--outFilterMatchNminOverLread 0.33 '
-            f'--outFilterMatchNmin 35 '
-            f'--alignSplicedMateMapLminOverLmate 0.33 '
-            f'--alignSplicedMateMapLmin 35 '
-            f'--alignSJstitchMismatchNmax 5 -1 5 5 '
-            f'--outFileNamePrefix {local_working_dir}/ '
-        )
-        self._run_bash_command(star_align_command)
-
-        output_bam_path = local_working_dir / "Aligned.out.bam"
-        if not output_bam_path.exists():
-            raise FileNotFoundError(f"Failed to create RNA bam: {output_bam_path}")
-        return output_bam_path
-
-    def sort_bam(
-            self,
-            local_input_bam_path: Path,
             local_output_bam_path: Path,
     ) -> None:
+        if self._star_genome_sharing_enabled:
+            self._load_star_genome_into_shared_memory(local_reference_resource_dir)
+            genome_load = "LoadAndKeep"
+        else:
+            genome_load = "NoSharedMemory"
         thread_count = self._get_thread_count()
-        bam_sort_command = (
-            f'"{self.SAMBAMBA}" sort -t {thread_count} -o "{local_output_bam_path}" "{local_input_bam_path}"'
-        )
+        star_thread_count = max(math.floor(self.STAR_MAXIMUM_THREAD_USAGE_FACTOR * thread_count), 1)
+
+        r1_files = ",".join(str(pair.read1) for pair in local_fastq_pairs)
+        r2_files = ",".join(str(pair.read2) for pair in local_fastq_pairs)
+        star_align_command = [
+            str(self.STAR),
+            "--runThreadN", str(star_thread_count),
+            "--genomeDir", str(local_reference_resource_dir),
+            "--genomeLoad", genome_load,
+            "--readFilesIn", r1_files, r2_files,
+            "--readFilesCommand", self._get_gzip_decompression_tool(), "-dc",
+            "--outSAMtype", "BAM", "Unsorted",
+            "--outStd", "BAM_Unsorted",
+            "--outSAMunmapped", "Within",
+            "--outBAMcompression", "0",
+            "--outSAMattributes", "All",
+            "--outFilterMultimapNmax", "10",
+            "--outFilterMismatchNmax", "3", "limitOutSJcollapsed", "3000000",
+            "--chimSegmentMin", "10",
+            "--chimOutType", "WithinBAM", "SoftClip",
+            "--chimJunctionOverhangMin", "10",
+            "--chimSegmentReadGapMax", "3",
+            "--chimScoreMin", "1",
+            "--chimScoreDropMax", "30",
+            "--chimScoreJunctionNonGTAG", "0",
+            "--chimScoreSeparation", "1",
+            "--outFilterScoreMinOverLread", "0.33",
+            "--outFilterMatchNminOverLread", "0.33",
+            "--outFilterMatchNmin", "35",
+            "--alignSplicedMateMapLminOverLmate", "0.33",
+            "--alignSplicedMateMapLmin", "35",
+            "--alignSJstitchMismatchNmax", "5", "-1", "5", "5",
+            "--outFileNamePrefix", f"{local_working_dir}/",
+        ]
+        # Sort the unsorted bam while STAR streams it out, instead of writing it to disk and reading it back
+        sort_thread_count = self._get_sambamba_thread_count()
+        bam_sort_command = [
+            str(self.SAMBAMBA), "sort", "-t", str(sort_thread_count), "-o", str(local_output_bam_path), "/dev/stdin",
+        ]
+
         create_parent_dir_if_not_exists(local_output_bam_path)
-        self._run_bash_command(bam_sort_command)
+        self._run_bash_command([star_align_command, bam_sort_command])
 
     def merge_bams(self, local_input_bams: List[Path], local_output_bam: Path) -> None:
-        thread_count = self._get_thread_count()
-        local_input_bams_string = " ".join(f'"{input_bam}"' for input_bam in local_input_bams)
-        merge_command = f'"{self.SAMBAMBA}" merge -t {thread_count} "{local_output_bam}" {local_input_bams_string}'
+        thread_count = self._get_sambamba_thread_count()
+        merge_command = [str(self.SAMBAMBA), "merge", "-t", str(thread_count), str(local_output_bam)]
+        merge_command.extend(str(input_bam) for input_bam in local_input_bams)
         create_parent_dir_if_not_exists(local_output_bam)
-        self._run_bash_command(merge_command)
+        self._run_bash_command([merge_command])
 
     def create_bam_index(self, local_bam_path: Path) -> None:
-        thread_count = self._get_thread_count()
-        index_command = f'"{self.SAMBAMBA}" index -t {thread_count} "{local_bam_path}"'
+        thread_count = self._get_sambamba_thread_count()
+        index_command = [str(self.SAMBAMBA), "index", "-t", str(thread_count), str(local_bam_path)]
         create_parent_dir_if_not_exists(local_bam_path)
-        self._run_bash_command(index_command)
+        self._run_bash_command([index_command])
 
     def deduplicate_without_umi(self, local_input_bam_path: Path, local_output_bam_path: Path) -> None:
-        thread_count = self._get_thread_count()
-        dedup_command = (
-            f'"{self.SAMBAMBA}" markdup -t {thread_count} '
-            f'--overflow-list-size={self.SAMBAMBA_MARKDUP_OVERFLOW_LIST_SIZE} '
-            f'"{local_input_bam_path}" "{local_output_bam_path}"'
-        )
+        thread_count = self._get_sambamba_thread_count()
+        dedup_command = [
+            str(self.SAMBAMBA), "markdup", "-t", str(thread_count),
+            f"--overflow-list-size={self.SAMBAMBA_MARKDUP_OVERFLOW_LIST_SIZE}",
+            str(local_input_bam_path), str(local_output_bam_path),
+        ]
         create_parent_dir_if_not_exists(local_output_bam_path)
-        self._run_bash_command(dedup_command)
+        self._run_bash_command([dedup_command])
 
     def deduplicate_with_umi(self, local_input_bam_path: Path, local_output_bam_path: Path) -> None:
-        dedup_command = (
-            f'{self.JAVA} -server -Xms8G -Xmx31G -Xss20M -jar "{self.UMI_COLLAPSE_JAR}" '
-            f'bam -i "{local_input_bam_path}" -o "{local_output_bam_path}" --umi-sep ":" --paired --two-pass'
-        )
+        dedup_command = [
+            self.JAVA, "-server", "-Xms8G", "-Xmx31G", "-Xss20M", "-jar", str(self.UMI_COLLAPSE_JAR),
+            "bam", "-i", str(local_input_bam_path), "-o", str(local_output_bam_path),
+            "--umi-sep", ":", "--paired", "--two-pass",
+        ]
         create_parent_dir_if_not_exists(local_output_bam_path)
-        self._run_bash_command(dedup_command)
+        self._run_bash_command([dedup_command])
 
     def flagstat(self, local_input_bam_path: Path, local_output_flagstat_path: Path) -> None:
-        thread_count = self._get_thread_count()
-        flagstat_command = (
-            f'"{self.SAMBAMBA}" flagstat -t "{thread_count}" "{local_input_bam_path}"'
-        )
+        thread_count = self._get_sambamba_thread_count()
+        flagstat_command = [str(self.SAMBAMBA), "flagstat", "-t", str(thread_count), str(local_input_bam_path)]
         create_parent_dir_if_not_exists(local_output_flagstat_path)
-        self._run_bash_command(flagstat_command, local_output_flagstat_path)
+        self._run_bash_command([flagstat_command], local_output_flagstat_path)
 
     def count_mapping_coords(self, local_input_bam_path: Path, local_output_path: Path) -> None:
-        thread_count = self._get_thread_count()
-        view_command = f'"{self.SAMBAMBA}" view -t "{thread_count}" "{local_input_bam_path}"'
-        select_command = 'awk \'{print $3 "\t" $4}\''
-        uniqueness_command = 'sort -u'
-        count_command = f'wc -l'
-        combined_command = " | ".join([view_command, select_command, uniqueness_command, count_command])
+        thread_count = self._get_sambamba_thread_count()
+        view_command = [str(self.SAMBAMBA), "view", "-t", str(thread_count), str(local_input_bam_path)]
+        select_command = ["cut", "-f", "3,4"]
+        # Byte-wise comparison in the C locale is much faster than locale-aware collation
+        uniqueness_command = [
+            "env", "LC_ALL=C", "sort", "-u", f"--parallel={thread_count}", f"--buffer-size={self.SORT_BUFFER_SIZE}",
+            f"--temporary-directory={local_output_path.parent}",
+        ]
+        count_command = ["wc", "-l"]
         create_parent_dir_if_not_exists(local_output_path)
-        self._run_bash_command(combined_command, local_output_path)
+        self._run_bash_command(
+            [view_command, select_command, uniqueness_command, count_command], local_output_path,
+        )
+
+    def set_star_genome_sharing(self, enabled: bool) -> None:
+        # Loading a STAR genome takes minutes, so RNA alignments can share it through shared memory
+        self._star_genome_sharing_enabled = enabled
+
+    def remove_shared_star_genomes(self) -> None:
+        # Shared memory outlives this process, so genomes have to be removed explicitly once they are no longer needed
+        for local_reference_resource_dir in sorted(self._star_genome_dirs_in_shared_memory):
+            try:
+                self._run_star_genome_load_command(local_reference_resource_dir, "Remove")
+            except ValueError as e:
+                logging.error(f"Failed to remove STAR genome {local_reference_resource_dir} from shared memory: {e}")
+        self._star_genome_dirs_in_shared_memory.clear()
+
+    def _load_star_genome_into_shared_memory(self, local_reference_resource_dir: Path) -> None:
+        if local_reference_resource_dir not in self._star_genome_dirs_in_shared_memory:
+            self._run_star_genome_load_command(local_reference_resource_dir, "LoadAndExit")
+            self._star_genome_dirs_in_shared_memory.add(local_reference_resource_dir)
+
+    def _run_star_genome_load_command(self, local_reference_resource_dir: Path, genome_load: str) -> None:
+        genome_load_command = [
+            str(self.STAR),
+            "--genomeDir", str(local_reference_resource_dir),
+            "--genomeLoad", genome_load,
+            "--outFileNamePrefix", f"{tempfile.gettempdir()}/star_genome_{genome_load}_",
+        ]
+        self._run_bash_command([genome_load_command])
+
+    @functools.lru_cache(maxsize=None)
+    def _get_gzip_decompression_tool(self) -> str:
+        if shutil.which(self.IGZIP) is not None:
+            return self.IGZIP
+        else:
+            return self.PIGZ
+
+    def _get_bwa_mem_tool(self, local_reference_genome_path: Path) -> Path:
+        bwa_mem2_index_paths = [
+            Path(f"{local_reference_genome_path}{suffix}") for suffix in self.BWA_MEM2_INDEX_SUFFIXES
+        ]
+        if all(path.exists() for path in bwa_mem2_index_paths):
+            return self.BWA_MEM2
+        else:
+            logging.info(f"No bwa-mem2 index found for {local_reference_genome_path}, so falling back to bwa mem")
+            return self.BWA
 
     def _get_thread_count(self) -> int:
-        return multiprocessing.cpu_count()
+        return get_available_cpu_count()
+
+    def _get_sambamba_thread_count(self) -> int:
+        return min(self._get_thread_count(), self.SAMBAMBA_MAXIMUM_THREAD_COUNT)
 
-    def _run_bash_command(self, command: str, output_file_path: Optional[Path] = None) -> BashCommandResults:
-        logging.info(f"Running bash command:\n{command}")
+    def _run_bash_command(
+            self, commands: List[List[str]], output_file_path: Optional[Path] = None,
+    ) -> None:
+        command_string = " | ".join(" ".join(shlex.quote(arg) for arg in command) for command in commands)
+        logging.info(f"Running bash command:\n{command_string}")
 
-        if not command:
-            raise SyntaxError(f"No command found to run: {command}")
+        if not commands or not all(commands):
+            raise SyntaxError(f"No command found to run: {command_string}")
 
         try:
-            output, errors, status = self._get_bash_command_output(command, output_file_path)
+            prioritized_commands = [self.TOOL_PRIORITY_PREFIX + command for command in commands]
+            errors, status = self._get_bash_command_output(prioritized_commands, output_file_path)
         except Exception as e:
-            output = ""
             errors = f"Exception: {e}"
             status = -1
 
         if status != 0:
             raise ValueError(f"Bash pipeline failed: status={status}, errors={errors}")
 
-        return BashCommandResults(output, errors, status)
-
-    def _get_bash_command_output(self, command: str, output_file_path: Optional[Path] = None) -> Tuple[str, str, int]:
+    def _get_bash_command_output(
+            self, commands: List[List[str]], output_file_path: Optional[Path] = None,
+    ) -> Tuple[Optional[str], int]:
         # Source: https://stackoverflow.com/questions/46117715/python-subprocess-call-and-pipes
         # Other source: https://stackoverflow.com/questions/9655841/python-subprocess-how-to-use-pipes-thrice
 
-        # Create pipeline of subprocesses that mimics bash piping
-        command_list = command.split(" | ")
-        processes: List[subprocess.Popen[bytes]] = []
-        for index, command in enumerate(command_list):
-            process_output: Union[TextIO, int]
-            if output_file_path is not None and index == len(command_list) - 1:
-                # Output of the last command should be redirected to the output file
-                process_output = open(output_file_path, "w+")
-            else:
-                process_output = subprocess.PIPE
-
-            args = shlex.split(command)
-            if index == 0:
-                process = subprocess.Popen(args, stdout=process_output)
-            else:
-                process = subprocess.Popen(args, stdin=processes[-1].stdout, stdout=process_output)
-            processes.append(process)
-
-        # Close pipelines in between the subprocesses.
-        # This allows earlier subprocesses to receive a SIGPIPE if a later subprocess exits.
-        # The final pipe is closed by the communicate method
-        for process in reversed(processes[:-1]):
-            if process.stdout is not None:
-                process.stdout.close()
-
-        output_bytes, errors_bytes = processes[-1].communicate()
-
-        # The output encoding is an assumption
-        output = None if output_bytes is None else output_bytes.decode(self.OUTPUT_ENCODING)
-        errors = None if errors_bytes is None else errors_bytes.decode(self.OUTPUT_ENCODING)
-        status = processes[-1].returncode
-
-        return output, errors, status
+        # Output of the last command is redirected to the output file if there is one, and otherwise
+        # goes to our own stdout. This way it never needs to be buffered in memory.
+        output_file = None if output_file_path is None else open(output_file_path, "w+")
+        try:
+            # Create pipeline of subprocesses that mimics bash piping
+            processes: List[subprocess.Popen[bytes]] = []
+            for index, command in enumerate(commands):
+                process_output: Union[TextIO, int, None]
+                if index == len(commands) - 1:
+                    process_output = output_file
+                else:
+                    process_output = subprocess.PIPE
+
+                if index == 0:
+                    process = subprocess.Popen(command, stdout=process_output, stderr=subprocess.PIPE)
+                else:
+                    process = subprocess.Popen(
+                        command, stdin=processes[-1].stdout, stdout=process_output, stderr=subprocess.PIPE,
+                    )
+                processes.append(process)
+
+            # Close pipelines in between the subprocesses.
+            # This allows earlier subprocesses to receive a SIGPIPE if a later subprocess exits.
+            for process in reversed(processes[:-1]):
+                if process.stdout is not None:
+                    process.stdout.close()
+
+            # Log the errors of all subprocesses while they are running, and only keep the last few lines in memory
+            error_lines: Deque[str] = collections.deque(maxlen=self.MAX_KEPT_ERROR_LINES)
+            error_logging_threads = [
+                threading.Thread(target=self._log_error_lines, args=(process, error_lines)) for process in processes
+            ]
+            for thread in error_logging_threads:
+                thread.start()
+
+            for process in processes:
+                process.wait()
+            for thread in error_logging_threads:
+                thread.join()
+        finally:
+            if output_file is not None:
+                output_file.close()
+
+        errors = "\n".join(error_lines) if error_lines else None
+        # Like bash with pipefail, the pipeline fails if any of its commands fails, not just the last one
+        failed_statuses = [process.returncode for process in processes if process.returncode != 0]
+        status = failed_statuses[-1] if failed_statuses else 0
+
+        return errors, status
+
+    def _log_error_lines(self, process: "subprocess.Popen[bytes]", error_lines: Deque[str]) -> None:
+        if process.stderr is None:
+            return
+        for line_bytes in process.stderr:
+            # The output encoding is an assumption
+            line = line_bytes.decode(self.OUTPUT_ENCODING, errors="replace").rstrip("\n")
+            logging.info(line)
+            error_lines.append(line)
+        process.stderr.close()
@@ -1,28 +1,47 @@
-from dataclasses import dataclass
+import sys
+from dataclasses import dataclass, field
+from typing import Tuple, TYPE_CHECKING
 
 
 @dataclass(frozen=True, order=True)
 class GCPPath(object):
+    __slots__ = ("bucket_name", "relative_path", "_string")
+
     bucket_name: str
     relative_path: str
+    # Paths are immutable and stringified a lot while logging listings, so the string is built only once.
+    # It is derived from the other fields, so it is left out of init, repr, eq, order and hash.
+    # At runtime it is only a slot, since a field default would clash with __slots__, so declare it for mypy alone.
+    if TYPE_CHECKING:
+        _string: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "_string", f"gs://{self.bucket_name}/{self.relative_path}")
+
+    def __getstate__(self) -> Tuple[str, ...]:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state: Tuple[str, ...]) -> None:
+        # The default way of restoring slots assigns them normally, which a frozen dataclass forbids
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, value)
 
     @classmethod
     def from_string(cls, path: str) -> "GCPPath":
         if not path.startswith("gs://"):
             raise ValueError(f"Path is not a GCP bucket path: '{path}'")
-        bucket_name = path.split("/")[2]
-        relative_path = "/".join(path.split("/")[3:])
-        return GCPPath(bucket_name, relative_path)
+        bucket_name, _, relative_path = path[len("gs://"):].partition("/")
+        return GCPPath(sys.intern(bucket_name), relative_path)
 
     def __str__(self) -> str:
-        return f"gs://{self.bucket_name}/{self.relative_path}"
+        return self._string
 
     def get_parent_directory(self) -> "GCPPath":
-        if self.relative_path[-1] == "/":
+        if self.relative_path.endswith("/"):
             relative_path = self.relative_path[:-1]
         else:
             relative_path = self.relative_path
-        parent_directory_relative_path = "/".join(relative_path.split("/")[:-1])
+        parent_directory_relative_path = relative_path.rpartition("/")[0]
         return GCPPath(self.bucket_name, parent_directory_relative_path)
 
     def append_suffix(self, suffix: str) -> "GCPPath":
@@ -1,56 +1,240 @@
+from __future__ import annotations
+
+import base64
+import concurrent.futures
 import fnmatch
+import functools
 import logging
+import math
+import os
+import re
+import sys
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List
-
-from google.cloud import storage
+from typing import Iterable, Iterator, List, Tuple, TYPE_CHECKING
 
 from services.gcp.base import GCPPath
+from services.gcp.file_slice import FileSlice
 from util import create_parent_dir_if_not_exists
 
+if TYPE_CHECKING:
+    from google.cloud import storage
+
 
 @dataclass(frozen=True)
 class GCPClient(object):
     client: storage.Client
 
+    WILDCARD_CHARACTERS_REGEX = re.compile(r"[*?\[]")
+    # Only the names of listed blobs are used, so don't let GCS send the rest of their metadata
+    LIST_BLOBS_FIELDS = "items(name),nextPageToken"
+
+    # A single download stream does not saturate the network, so large files are downloaded in parallel slices
+    SLICED_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+    SLICED_DOWNLOAD_SLICE_SIZE = 64 * 1024 * 1024
+    SLICED_DOWNLOAD_THREADS = 8
+    PARTIAL_DOWNLOAD_SUFFIX = ".part"
+    CHECKSUM_READ_SIZE = 8 * 1024 * 1024
+    # Large files are uploaded as separate slice objects in parallel, which are then composed into the final file
+    SLICED_UPLOAD_THRESHOLD = 256 * 1024 * 1024
+    SLICED_UPLOAD_MIN_SLICE_SIZE = 64 * 1024 * 1024
+    SLICED_UPLOAD_MAX_SLICE_COUNT = 32  # maximum number of objects that GCS can compose in one request
+    SLICED_UPLOAD_THREADS = 8
+
     def file_exists(self, path: GCPPath) -> bool:
         return bool(self._get_blob(path).exists())
 
+    def local_copy_is_complete(self, gcp_path: GCPPath, local_path: Path) -> bool:
+        blob = self._get_bucket(gcp_path.bucket_name).get_blob(gcp_path.relative_path)
+        if blob is None:
+            raise FileNotFoundError(f"Cannot compare local copy to file that doesn't exist: {gcp_path}")
+        # GCS decompresses gzip-encoded files on download, so only the sizes of other files can be compared
+        return blob.content_encoding is not None or local_path.stat().st_size == blob.size
+
     def download_file(self, gcp_path: GCPPath, local_path: Path) -> None:
         logging.info(f"Starting download of '{gcp_path}' to '{local_path}'.")
-        if not self.file_exists(gcp_path):
+        # Also fetches the metadata of the blob, which is needed to decide whether to download in slices
+        blob = self._get_bucket(gcp_path.bucket_name).get_blob(gcp_path.relative_path)
+        if blob is None:
             raise FileNotFoundError(f"Cannot download file that doesn't exist: {gcp_path}")
         create_parent_dir_if_not_exists(local_path)
-        self._get_blob(gcp_path).download_to_filename(str(local_path))
-        if not local_path.exists():
-            raise FileNotFoundError(f"Download of '{gcp_path}' to '{local_path}' has failed.")
+        partial_local_path = local_path.with_name(local_path.name + self.PARTIAL_DOWNLOAD_SUFFIX)
+        # A run that crashed mid-download can have left a partial file behind
+        self._remove_partial_download(partial_local_path)
+        try:
+            # Slices are downloaded raw, so files that GCS decompresses on download are downloaded in one go
+            if blob.size > self.SLICED_DOWNLOAD_THRESHOLD and blob.content_encoding is None:
+                self._download_blob_in_slices(blob, partial_local_path)
+            else:
+                blob.download_to_filename(str(partial_local_path))
+        except BaseException:
+            # Don't leave a partial file behind to take up disk space
+            try:
+                self._remove_partial_download(partial_local_path)
+            except OSError as e:
+                logging.warning(f"Failed to remove partial download '{partial_local_path}': {e}")
+            raise
+        # Only finished downloads get the final name, so an interrupted download is never mistaken for a cached file
+        os.replace(partial_local_path, local_path)
         logging.info(f"Finished download of '{gcp_path}' to '{local_path}'.")
 
     def upload_file(self, local_path: Path, gcp_path: GCPPath) -> None:
         logging.info(f"Starting upload of '{local_path}' to '{gcp_path}'.")
         if not local_path.exists():
             raise FileNotFoundError(f"Cannot upload file that doesn't exist: '{local_path}'")
-        self._get_blob(gcp_path).upload_from_filename(str(local_path))
-        if not self.file_exists(gcp_path):
-            raise FileNotFoundError(f"Upload of '{local_path}' to '{gcp_path}' has failed.")
+        # Generation precondition 0 makes GCS refuse the upload if the file has been created in the meantime
+        if local_path.stat().st_size > self.SLICED_UPLOAD_THRESHOLD:
+            self._upload_file_in_slices(local_path, gcp_path)
+        else:
+            self._get_blob(gcp_path).upload_from_filename(str(local_path), if_generation_match=0)
+        # Failed uploads raise, so there is no need to check the existence of the file afterwards
+        self._clear_listing_caches()
         logging.info(f"Finished upload of '{local_path}' to '{gcp_path}'.")
 
     def get_files_in_directory(self, path: GCPPath) -> List[GCPPath]:
+        return list(self._get_cached_files_in_directory(path))
+
+    def iterate_files_in_directory(self, path: GCPPath) -> Iterator[GCPPath]:
         if path.relative_path[-1] != "/":
             prefix = path.relative_path + "/"
         else:
             prefix = path.relative_path
-        blobs = self.client.list_blobs(path.bucket_name, prefix=prefix, delimiter="/")
-        return [GCPPath(path.bucket_name, blob.name) for blob in blobs]
+        bucket_name = sys.intern(path.bucket_name)
+        blobs = self.client.list_blobs(bucket_name, prefix=prefix, delimiter="/", fields=self.LIST_BLOBS_FIELDS)
+        for blob in blobs:
+            yield GCPPath(bucket_name, blob.name)
 
     def get_matching_file_paths(self, path: GCPPath) -> List[GCPPath]:
-        matching_paths: List[GCPPath] = []
-        prefix_to_match = path.relative_path.split("*")[0]
-        for blob in self.client.list_blobs(path.bucket_name, prefix=prefix_to_match):
-            if fnmatch.fnmatch(blob.name, path.relative_path):
-                matching_paths.append(GCPPath(path.bucket_name, blob.name))
-        return matching_paths
+        return list(self._get_cached_matching_file_paths(path))
+
+    def iterate_matching_file_paths(self, path: GCPPath) -> Iterator[GCPPath]:
+        bucket_name = sys.intern(path.bucket_name)
+        pattern = re.compile(fnmatch.translate(path.relative_path))
+        for blob in self._list_blobs_matching_wildcard_path(path):
+            if pattern.match(blob.name):
+                yield GCPPath(bucket_name, blob.name)
+
+    # Jobs in the same run often list the same reference genome directory, so listings are cached until an upload
+    @functools.lru_cache(maxsize=128)
+    def _get_cached_files_in_directory(self, path: GCPPath) -> Tuple[GCPPath, ...]:
+        return tuple(self.iterate_files_in_directory(path))
+
+    @functools.lru_cache(maxsize=128)
+    def _get_cached_matching_file_paths(self, path: GCPPath) -> Tuple[GCPPath, ...]:
+        return tuple(self.iterate_matching_file_paths(path))
+
+    def _clear_listing_caches(self) -> None:
+        GCPClient._get_cached_files_in_directory.cache_clear()
+        GCPClient._get_cached_matching_file_paths.cache_clear()
+
+    def _list_blobs_matching_wildcard_path(self, path: GCPPath) -> Iterable[storage.Blob]:
+        prefix_to_match = self.WILDCARD_CHARACTERS_REGEX.split(path.relative_path, maxsplit=1)[0]
+        # A '*' wildcard also matches '/', which in GCS glob syntax is written as '**'.
+        # The server-side glob only narrows down the listing, the caller still does the exact matching.
+        match_glob = path.relative_path.replace("*", "**")
+        blobs: Iterable[storage.Blob]
+        try:
+            blobs = self.client.list_blobs(
+                path.bucket_name, prefix=prefix_to_match, match_glob=match_glob, fields=self.LIST_BLOBS_FIELDS,
+            )
+        except TypeError:
+            # match_glob is only supported from google-cloud-storage 2.14 onwards
+            blobs = self.client.list_blobs(path.bucket_name, prefix=prefix_to_match, fields=self.LIST_BLOBS_FIELDS)
+        return blobs
+
+    def _download_blob_in_slices(self, blob: storage.Blob, local_path: Path) -> None:
+        blob_size = int(blob.size)
+        slice_starts = range(0, blob_size, self.SLICED_DOWNLOAD_SLICE_SIZE)
+        logging.info(f"Downloading '{blob.name}' to '{local_path}' in {len(slice_starts)} slices.")
+        with open(local_path, "wb") as local_file:
+            local_file.truncate(blob_size)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.SLICED_DOWNLOAD_THREADS) as executor:
+            futures = [
+                executor.submit(self._download_blob_slice, blob, local_path, slice_start, blob_size)
+                for slice_start in slice_starts
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+        # The library does not verify ranged downloads, so check the assembled file as a whole
+        self._verify_crc32c_checksum(blob, local_path)
+
+    def _download_blob_slice(self, blob: storage.Blob, local_path: Path, slice_start: int, blob_size: int) -> None:
+        slice_end = min(slice_start + self.SLICED_DOWNLOAD_SLICE_SIZE, blob_size) - 1
+        with open(local_path, "r+b") as local_file:
+            local_file.seek(slice_start)
+            blob.download_to_file(local_file, start=slice_start, end=slice_end, raw_download=True)
+
+    def _remove_partial_download(self, partial_local_path: Path) -> None:
+        try:
+            partial_local_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _verify_crc32c_checksum(self, blob: storage.Blob, local_path: Path) -> None:
+        # Imported here, since importing the library is slow and not needed for dry runs
+        import google_crc32c
+        checksum = google_crc32c.Checksum()
+        with open(local_path, "rb") as local_file:
+            chunk = local_file.read(self.CHECKSUM_READ_SIZE)
+            while chunk:
+                checksum.update(chunk)
+                chunk = local_file.read(self.CHECKSUM_READ_SIZE)
+        local_crc32c = base64.b64encode(checksum.digest()).decode("ascii")
+        if local_crc32c != blob.crc32c:
+            error_msg = (
+                f"CRC32C checksum of downloaded file '{local_path}' is '{local_crc32c}', "
+                f"but the checksum of '{blob.name}' at GCP is '{blob.crc32c}'."
+            )
+            raise ValueError(error_msg)
+
+    def _upload_file_in_slices(self, local_path: Path, gcp_path: GCPPath) -> None:
+        file_size = local_path.stat().st_size
+        slice_size = max(self.SLICED_UPLOAD_MIN_SLICE_SIZE, math.ceil(file_size / self.SLICED_UPLOAD_MAX_SLICE_COUNT))
+        slice_starts = range(0, file_size, slice_size)
+        slice_blobs = [
+            self._get_blob(gcp_path.append_suffix(f".slice{index}")) for index in range(len(slice_starts))
+        ]
+        logging.info(f"Uploading '{local_path}' to '{gcp_path}' in {len(slice_starts)} slices.")
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.SLICED_UPLOAD_THREADS) as executor:
+                futures = [
+                    executor.submit(
+                        self._upload_file_slice,
+                        local_path,
+                        slice_blob,
+                        slice_start,
+                        min(slice_size, file_size - slice_start),
+                    )
+                    for slice_blob, slice_start in zip(slice_blobs, slice_starts)
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            self._get_blob(gcp_path).compose(slice_blobs, if_generation_match=0)
+        finally:
+            self._delete_slice_blobs(slice_blobs)
+
+    def _delete_slice_blobs(self, slice_blobs: List[storage.Blob]) -> None:
+        # Imported here, since importing the library is slow and not needed for dry runs
+        from google.api_core.exceptions import NotFound
+        # Failures are only logged, so that they cannot hide an exception raised by the upload itself
+        for slice_blob in slice_blobs:
+            try:
+                slice_blob.delete()
+            except NotFound:
+                pass  # slice was never uploaded
+            except Exception as e:
+                logging.warning(f"Failed to delete temporary upload slice '{slice_blob.name}': {e}")
+
+    def _upload_file_slice(self, local_path: Path, slice_blob: storage.Blob, slice_start: int, slice_size: int) -> None:
+        # Resumable uploads require the stream to start at position 0, so upload a view of the slice instead of
+        # seeking within the file
+        with open(local_path, "rb") as local_file:
+            slice_blob.upload_from_file(FileSlice(local_file, slice_start, slice_size), size=slice_size)
 
     def _get_blob(self, path: GCPPath) -> storage.Blob:
-        return self.client.bucket(path.bucket_name).blob(path.relative_path)
+        return self._get_bucket(path.bucket_name).blob(path.relative_path)
+
+    @functools.lru_cache(maxsize=16)
+    def _get_bucket(self, bucket_name: str) -> storage.Bucket:
+        # Creates a local handle without checking the existence of the bucket, so no request is made
+        return self.client.bucket(bucket_name)
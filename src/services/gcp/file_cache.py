@@ -1,11 +1,13 @@
 import concurrent.futures
+import functools
 import logging
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import Iterable
 
 from services.gcp.base import GCPPath
 from services.gcp.client import GCPClient
+from util import get_available_cpu_count
 
 
 @dataclass(frozen=True)
@@ -22,8 +24,12 @@ class GCPFileCache(object):
     SKIP_STATUS = "SKIP"
     SUCCESS_STATUS = "SUCCESS"
 
-    def multiple_download_to_local(self, gcp_paths: List[GCPPath]) -> None:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+    # Transfers are latency-bound rather than CPU-bound, so use more threads than there are CPUs
+    TRANSFER_THREADS_PER_CPU = 4
+    MAX_TRANSFER_THREADS = 64
+
+    def multiple_download_to_local(self, gcp_paths: Iterable[GCPPath]) -> None:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._get_transfer_thread_count()) as executor:
             future_to_path = {}
             for gcp_path in gcp_paths:
                 logging.info(f"Submitting download of '{gcp_path}'")
@@ -37,8 +43,8 @@ class GCPFileCache(object):
                 except Exception as exc:
                     raise ValueError(exc)
 
-    def multiple_upload_from_local(self, gcp_paths: List[GCPPath]) -> None:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+    def multiple_upload_from_local(self, gcp_paths: Iterable[GCPPath]) -> None:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._get_transfer_thread_count()) as executor:
             future_to_path = {}
             for gcp_path in gcp_paths:
                 logging.info(f"Submitting upload to '{gcp_path}'")
@@ -55,11 +61,13 @@ class GCPFileCache(object):
     def download_to_local(self, gcp_path: GCPPath) -> str:
         local_path = self.get_local_path(gcp_path)
         if local_path.exists():
-            logging.info(f"Skipping download of '{gcp_path}' since it is already in the local file cache.")
-            return self.SKIP_STATUS
-        else:
-            self.gcp_client.download_file(gcp_path, local_path)
-            return self.SUCCESS_STATUS
+            # A download that was interrupted by a crash can leave a truncated file behind
+            if self.gcp_client.local_copy_is_complete(gcp_path, local_path):
+                logging.info(f"Skipping download of '{gcp_path}' since it is already in the local file cache.")
+                return self.SKIP_STATUS
+            logging.warning(f"Downloading '{gcp_path}' again since the copy in the local file cache is incomplete.")
+        self.gcp_client.download_file(gcp_path, local_path)
+        return self.SUCCESS_STATUS
 
     def upload_from_local(self, gcp_path: GCPPath) -> str:
         local_path = self.get_local_path(gcp_path)
@@ -72,5 +80,9 @@ class GCPFileCache(object):
             self.gcp_client.upload_file(local_path, gcp_path)
             return self.SUCCESS_STATUS
 
+    @functools.lru_cache(maxsize=None)
     def get_local_path(self, gcp_path: GCPPath) -> Path:
         return self.local_directory / gcp_path.bucket_name / gcp_path.relative_path
+
+    def _get_transfer_thread_count(self) -> int:
+        return min(self.MAX_TRANSFER_THREADS, self.TRANSFER_THREADS_PER_CPU * get_available_cpu_count())
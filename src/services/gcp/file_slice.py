@@ -0,0 +1,49 @@
+import io
+import os
+from typing import BinaryIO
+
+
+class FileSlice(object):
+    """
+    Read-only view of a byte range of an open file, that behaves like a file of its own.
+
+    Positions are relative to the start of the range, so uploads that require a stream to start
+    at position 0 can upload the range without copying it.
+    """
+    def __init__(self, file: BinaryIO, start: int, size: int) -> None:
+        self.file = file
+        self.start = start
+        self.size = size
+        self.position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        remaining_size = max(self.size - self.position, 0)
+        if size < 0 or size > remaining_size:
+            size = remaining_size
+        # Reading at an explicit offset leaves the position of the underlying file untouched
+        data = os.pread(self.file.fileno(), size, self.start + self.position)
+        self.position += len(data)
+        return data
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence value: {whence}")
+        if position < 0:
+            raise ValueError(f"Cannot seek to negative position: {position}")
+        self.position = position
+        return self.position
+
+    def seekable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
@@ -1,7 +1,8 @@
-from dataclasses import dataclass
-from typing import Optional
+from __future__ import annotations
 
-from google.cloud import storage
+import logging
+from dataclasses import dataclass
+from typing import Optional, TYPE_CHECKING
 
 from config import Config
 from services.arg_parser import ArgumentParser
@@ -10,6 +11,9 @@ from services.gcp.client import GCPClient
 from services.gcp.file_cache import GCPFileCache
 from services.service_provider_abc import ServiceProviderABC
 
+if TYPE_CHECKING:
+    from google.cloud import storage
+
 
 @dataclass()
 class ServiceProvider(ServiceProviderABC):
@@ -21,6 +25,10 @@ class ServiceProvider(ServiceProviderABC):
     _bash_toolbox: Optional[BashToolbox] = None
     _argument_parser: Optional[ArgumentParser] = None
 
+    # Files are transferred on many threads at once. Without a large enough connection pool, connections are
+    # thrown away after each request, so every request has to set up a new TLS connection.
+    GCP_CONNECTION_POOL_SIZE = 128
+
     def get_config(self) -> Config:
         return self.config
 
@@ -36,7 +44,16 @@ class ServiceProvider(ServiceProviderABC):
 
     def get_library_gcp_client(self) -> storage.Client:
         if self._library_gcp_client is None:
-            self._library_gcp_client = storage.Client()
+            # Imported here, since importing the library is slow and not needed for dry runs
+            from google.auth import default as google_auth_default
+            from google.auth.transport.requests import AuthorizedSession
+            from google.cloud import storage
+            from requests.adapters import HTTPAdapter
+            self._warn_if_crc32c_is_slow()
+            credentials, _ = google_auth_default(scopes=storage.Client.SCOPE)
+            authorized_session = AuthorizedSession(credentials)
+            authorized_session.mount("https://", HTTPAdapter(pool_maxsize=self.GCP_CONNECTION_POOL_SIZE))
+            self._library_gcp_client = storage.Client(credentials=credentials, _http=authorized_session)
         return self._library_gcp_client
 
     def get_bash_toolbox(self) -> BashToolbox:
@@ -48,3 +65,11 @@ class ServiceProvider(ServiceProviderABC):
         if self._argument_parser is None:
             self._argument_parser = ArgumentParser()
         return self._argument_parser
+
+    def _warn_if_crc32c_is_slow(self) -> None:
+        # CRC32C checksums of multi-GB transfers are very slow without the C extension
+        import google_crc32c
+        if google_crc32c.implementation != "c":
+            logging.warning(
+                f"Using the slow '{google_crc32c.implementation}' implementation of CRC32C for GCP transfers",
+            )
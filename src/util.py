@@ -1,6 +1,15 @@
+import contextlib
+import functools
 import logging
+import os
 import shutil
+import threading
+import uuid
 from pathlib import Path
+from typing import Iterator
+
+# Directories that are being deleted in the background are first renamed to include this
+OLD_DIRECTORY_INFIX = "_old_"
 
 
 def set_up_logging() -> None:
@@ -10,6 +19,12 @@ def set_up_logging() -> None:
     logging.getLogger("urllib3").setLevel(logging.ERROR)
 
 
+@functools.lru_cache(maxsize=None)
+def get_available_cpu_count() -> int:
+    # Only count the CPUs this process is allowed to run on, which can be fewer than the CPUs of the machine
+    return len(os.sched_getaffinity(0))
+
+
 def create_or_cleanup_dir(directory: Path) -> None:
     if directory.is_dir():
         shutil.rmtree(directory)
@@ -18,5 +33,32 @@ def create_or_cleanup_dir(directory: Path) -> None:
     directory.mkdir(parents=True)
 
 
+@contextlib.contextmanager
+def temporary_dir(directory: Path) -> Iterator[Path]:
+    # Clean up leftovers of earlier runs that were aborted
+    for old_directory in directory.parent.glob(f"{directory.name}{OLD_DIRECTORY_INFIX}*"):
+        _remove_dir_in_background(old_directory)
+    create_or_cleanup_dir(directory)
+    try:
+        yield directory
+    finally:
+        # Renaming is instant, so whatever comes next doesn't have to wait for the deletion of the contents
+        old_directory = directory.with_name(f"{directory.name}{OLD_DIRECTORY_INFIX}{uuid.uuid4().hex}")
+        try:
+            directory.rename(old_directory)
+        except OSError as e:
+            # Don't let a failed cleanup hide the exception that the job itself might have raised
+            logging.warning(f"Could not rename '{directory}' before deleting it, so deleting it in place: {e}")
+            shutil.rmtree(directory, ignore_errors=True)
+        else:
+            _remove_dir_in_background(old_directory)
+
+
+def _remove_dir_in_background(directory: Path) -> None:
+    threading.Thread(
+        target=shutil.rmtree, args=(directory,), kwargs={"ignore_errors": True}, name=f"cleanup-{directory.name}",
+    ).start()
+
+
 def create_parent_dir_if_not_exists(path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)